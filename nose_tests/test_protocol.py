@@ -235,3 +235,36 @@ class TestProtocol(unittest.TestCase):
     def test_misc(self):
         #TODO: Not done yet
         pass
+
+    def test_pipeline(self):
+        pipe = self.p.pipeline()
+        pipe.misc('putlist', ['foo', 'bar\0baz', 'fox', 'box\0quux'])
+        pipe.misc('getlist', ['foo', 'fox'])
+        assert self.p.rnum() == 0
+        assert pipe.execute() == [[], ['foo', 'bar\0baz', 'fox', 'box\0quux']]
+        assert self.p.rnum() == 2
+        assert pipe.execute() == []
+        pipe.mget(['foo', 'fox'])
+        pipe.mget(['not_exists'])
+        ret, missing = pipe.execute()
+        assert sorted(ret) == [('foo', 'bar\0baz'), ('fox', 'box\0quux')]
+        assert missing == []
+
+    def test_pipeline_batches(self):
+        # more requests than are sent at once
+        pipe = self.p.pipeline()
+        value = 'x\0' + 'y' * 1000
+        for i in xrange(100):
+            pipe.misc('putlist', ['key%d' % i, value])
+        pipe.mget(['key0', 'key99'])
+        results = pipe.execute()
+        assert len(results) == 101
+        assert sorted(results[-1]) == [('key0', value), ('key99', value)]
+        assert self.p.rnum() == 100
+
+    def test_pipeline_errors(self):
+        pipe = self.p.pipeline()
+        pipe.misc('invented_function', [])
+        pipe.misc('putlist', ['foo', 'bar\0baz'])
+        self.assertRaises(exceptions.InvalidOperation, pipe.execute)
+        assert self.p.get('foo') == 'bar\0baz'
@@ -13,7 +13,7 @@ from nose import *
 
 # the app
 from pyrant import Tyrant
-from pyrant.query import Query
+from pyrant.query import Condition, Query
 
 
 def query_equals(query, keys):
@@ -27,6 +27,13 @@ def query_equals(query, keys):
     return False
 
 
+def cached_chunks(query):
+    """
+    Returns numbers of chunks currently held by the query's result cache.
+    """
+    return [n for n, data in enumerate(query._cache.chunks) if data is not None]
+
+
 class TestTyrant(unittest.TestCase):
     TYRANT_HOST = '127.0.0.1'
     TYRANT_PORT = 1983
@@ -95,6 +102,21 @@ strawberry\tFarmer's Market\tred\t3.15\t214
 
         self.data = data
 
+    def count_batches(self, query):
+        """
+        Returns a list that grows by one item per pipelined round-trip of the
+        query. The protocol is patched until the test ends.
+        """
+        batches = []
+        proto = query._proto
+        real_pipeline = proto.pipeline
+        def counting_pipeline():
+            batches.append(1)
+            return real_pipeline()
+        proto.pipeline = counting_pipeline
+        self.addCleanup(delattr, proto, 'pipeline')
+        return batches
+
     def _set_test_data(self):
         self.t.update(self.data)
 
@@ -116,6 +138,11 @@ strawberry\tFarmer's Market\tred\t3.15\t214
         assert sliced(None, 1) == keys[:1]
         assert sliced(0, 2) == keys[0:2]
         assert sliced(2, 4) == keys[2:4]
+        assert sliced(0, 0) == []
+        assert sliced(3, 3) == []
+        assert sliced(4, 2) == []
+        self.assertRaises(ValueError, lambda: q[-1:])
+        self.assertRaises(ValueError, lambda: q[:-1])
 
     def test_cache_chunks(self):
         keys = 'apple blueberry peach pear raspberry strawberry'.split()
@@ -148,6 +175,90 @@ strawberry\tFarmer's Market\tred\t3.15\t214
         self.assertRaises(IndexError,
                           lambda: get_item(q, 3, 10) == self.t[ keys[1] ])
 
+    def test_cache_limit(self):
+        keys = 'apple blueberry peach pear raspberry strawberry'.split()
+        q = self.q.exclude(a=123).order_by('id')
+        q.set_chunk_size(1)
+        q._cache.max_chunks = 2
+        assert [k for k,v in q[:]] == keys
+        assert len(cached_chunks(q)) == 2
+        # dropped chunks are fetched again
+        assert q[0][0] == keys[0]
+        assert q[5][0] == keys[5]
+        assert len(cached_chunks(q)) == 2
+
+    def test_iter_all(self):
+        keys = 'apple blueberry peach pear raspberry strawberry'.split()
+        q = self.q.exclude(a=123).order_by('id')
+        items = list(q.iter_all(chunk_size=4))
+        assert [k for k,v in items] == keys
+        assert items[0][1] == self.t['apple']
+        # streamed items are not cached
+        assert cached_chunks(q) == []
+        assert repr(q).startswith("[('apple', {")
+        assert cached_chunks(q) == []
+        assert repr(self.q.filter(color='purple')) == '[]'
+        # plain iteration streams the items too, unless they are all cached
+        assert [k for k,v in q] == keys
+        assert cached_chunks(q) == []
+        assert len(q[:]) == 6
+        batches = self.count_batches(q)
+        assert [k for k,v in q] == keys
+        # the cache was used
+        assert len(batches) == 0
+
+        # chunks are streamed in pipelined batches
+        q._cache.prefetch = 1
+        assert [k for k,v in q.iter_all(chunk_size=2)] == keys
+        assert len(batches) == 2
+
+    def test_large_slice(self):
+        # the replies to a batch of requests must not fill the socket buffers
+        # while the requests are still being sent
+        count = 100000
+        self.t.multi_set(('key%d' % i, {'n': str(i)}) for i in xrange(count))
+        assert len(self.t.query[:]) == count + len(self.data)
+        assert len(self.t.query[10:]) == count + len(self.data) - 10
+        assert len(list(self.t.query.iter_all(prefetch=100))) == count + len(self.data)
+
+    def test_raw_values(self):
+        # values are returned as stored, whatever their encoding is
+        self.t['cafe'] = {'name': 'caf\xe9'}
+        q = self.t.query.filter(name__startswith='caf')
+        assert q[:] == [('cafe', {'name': 'caf\xe9'})]
+        assert list(q.exclude(a=123)) == [('cafe', {'name': 'caf\xe9'})]
+        assert q.stat() == {'name': 1}
+
+    def test_cache_prefetch(self):
+        keys = 'apple blueberry peach pear raspberry strawberry'.split()
+        q = self.q.exclude(a=123).order_by('id')
+        q.set_chunk_size(2)
+
+        batches = self.count_batches(q)
+
+        # chunk #1 is fetched along with chunk #0
+        assert [k for k,v in q[:4]] == keys[:4]
+        assert cached_chunks(q) == [0, 1]
+        assert len(batches) == 1
+        # nothing is fetched beyond the slice
+        assert [k for k,v in q[4:5]] == keys[4:5]
+        assert cached_chunks(q) == [0, 1, 2]
+        assert len(batches) == 2
+        # a bounded slice is fetched at once
+        q.set_chunk_size(1)
+        assert [k for k,v in q[1:5]] == keys[1:5]
+        assert cached_chunks(q) == [1, 2, 3, 4]
+        assert len(batches) == 3
+        # so is an open one
+        q.set_chunk_size(1)
+        assert [k for k,v in q[2:]] == keys[2:]
+        assert cached_chunks(q) == [2, 3, 4, 5]
+        assert len(batches) == 4
+        # but no more than CACHE_BATCH_CHUNKS chunks are fetched at once
+        q.set_chunk_size(1)
+        assert [k for k,v in q[:]] == keys
+        assert len(batches) == 6
+
     def test_exact_match(self):
         #Test implicit __is operator
         apple = self.q.filter(id="apple")[:]
@@ -327,9 +438,16 @@ strawberry\tFarmer's Market\tred\t3.15\t214
         assert stock_fruits_desc[1][0] == "apple"
         assert stock_fruits_desc[2][0] == "blueberry"
 
+        #Ordering is kept by derived queries
+        cheap_fruits = stock_fruits_desc.filter(stock__lt=200)
+        assert [k for k,v in cheap_fruits[:]] == ["apple", "blueberry"]
+
     def test_values(self):
         assert self.q.values("color") == [u'blue', u'yellow', u'red']
         assert self.q.values("store") == [u'Shopway', u"Farmer's Market", u'Convenience Store']
+        # records without given column are ignored
+        self.t["melon"] = dict(id="melon")
+        assert set(self.q.values("color")) == set([u'blue', u'yellow', u'red'])
 
     def test_stat(self):
         assert self.q.stat() == {u'color': 6, u'price': 6, u'id': 6, u'store': 6, u'stock': 6}
@@ -343,6 +461,7 @@ strawberry\tFarmer's Market\tred\t3.15\t214
         not_blue = self.q.filter(color="red") | self.q.filter(color="yellow")
         assert len(not_blue) == 5
         assert "blueberry" not in not_blue
+        assert "apple" in not_blue
 
         complex_or = self.q.filter(color="blue") | self.q.filter(store="Shopway")
         print complex_or
@@ -395,11 +514,35 @@ strawberry\tFarmer's Market\tred\t3.15\t214
     def test_count(self):
         q_red = self.q.filter(color="red")
         assert q_red.count() == 3
+        cached = self.q.filter(color="red")
+        assert len(cached[:]) == 3
         del self.t["apple"]
         assert q_red.count() == 2
+        # once fetched, the keys are not counted again
+        assert len(cached) == 3
 
     def test_hint(self):
         q_apple = self.q.filter(id="apple")
         q_red = self.q.filter(color="red")
         assert "HINT" in q_red.hint()
         assert "HINT" in q_apple.hint()
+
+    def test_condition_iterables(self):
+        assert Condition('f', xrange(3)).prepare()[2] == u'0, 1, 2'
+        assert Condition('f', (x for x in 'ab')).prepare()[2] == u'a, b'
+        cond = Condition('f__in', (x for x in 'ab'))
+        expected = cond.prepare()
+        cond.negate = True
+        assert cond.prepare()[2] == expected[2]
+        assert query_equals(self.q.filter(stock__in=xrange(300, 301)), 'peach')
+
+    def test_condition_prepare(self):
+        cond = self.q.filter(stock__gt=200)._conditions[0]
+        assert cond.prepare() is cond.prepare()
+        name, op, value = cond.prepare()
+        cond.negate = True
+        assert cond.prepare()[1] != op
+        cond.negate = False
+        cond.expr = 100
+        assert cond.prepare()[2] != value
+        assert query_equals(self.q.filter(stock__gt=200), 'peach strawberry')
@@ -7,6 +7,7 @@ try:
 except NameError:
     from sets import Set as set
 import uuid
+import weakref
 
 # testing
 import unittest
@@ -133,6 +134,13 @@ class TestTyrant(unittest.TestCase):
         db_keys = set([key for key in g])
         assert keys == db_keys
 
+    def test_iterkeys_batches(self):
+        # keys are fetched in batches, make sure none is lost at the borders
+        self.t.multi_set(('key%d' % i, dict(num=str(i))) for i in range(600))
+        keys = list(self.t.iterkeys())
+        assert len(keys) == 606
+        assert len(set(keys)) == 606
+
     def test_keys(self):
         assert self.t.keys() == "apple blueberry peach pear raspberry strawberry".split() #BTree and Tables are ordered
 
@@ -199,6 +207,9 @@ class TestTyrant(unittest.TestCase):
         assert len(fruits) == 2
         assert "apple" in fruits
         assert "pear" in fruits
+        # keys can be streamed
+        fruits = dict(self.t.multi_get(k for k in ["apple", "pear"]))
+        assert len(fruits) == 2
 
     def test_multi_set(self):
         self.t.multi_set(dict(
@@ -210,6 +221,42 @@ class TestTyrant(unittest.TestCase):
         assert self.t["melon"] == dict(store="VillaConejos", color="green")
         assert self.t["tomatoe"] == dict(store="Bah de Perales", color="red")
 
+    def test_multi_set_chunks(self):
+        items = [('item%d' % i, dict(num=str(i))) for i in range(10)]
+        self.t.multi_set(items, chunk_size=3)
+        assert len(self.t) == 16
+        assert self.t["item9"] == dict(num="9")
+
+    def test_multi_set_streams(self):
+        stored = []
+        def items():
+            for i in range(10):
+                if i == 5:
+                    # the complete chunks must be stored already
+                    stored.append(len(self.t))
+                yield 'item%d' % i, dict(num=str(i))
+        self.t.multi_set(items(), chunk_size=2)
+        assert stored == [10]
+        assert len(self.t) == 16
+
+    def test_weakref(self):
+        ref = weakref.ref(self.t)
+        assert ref() is self.t
+
+    def test_pipeline(self):
+        with self.t.pipeline() as pipe:
+            pipe.multi_set(dict(melon=dict(store="VillaConejos", color="green")))
+            pipe.multi_get(["apple", "melon"])
+            pipe.multi_del(["apple"])
+            assert "melon" not in self.t
+        assert "melon" in self.t
+        assert "apple" not in self.t
+        assert pipe.results[0] is None
+        assert dict(pipe.results[1]) == dict(
+            apple=dict(store="Convenience Store", color="red"),
+            melon=dict(store="VillaConejos", color="green"))
+        assert pipe.results[2] is None
+
     def test_prefix_keys(self):
         fruits_a = self.t.prefix_keys("a")
         assert len(fruits_a) == 1
@@ -29,7 +29,6 @@ Usage example (note the automatically managed support for table database)::
 
 """
 
-import itertools
 import uuid
 
 # pyrant
@@ -47,6 +46,9 @@ __all__ = ['Tyrant']
 DEFAULT_HOST = '127.0.0.1'
 DEFAULT_PORT = 1978
 
+# marks a type that is not in a handler table (None is a valid handler)
+_MISSING = object()
+
 
 class Tyrant(object):
     """A Python dictionary API for Tokyo Tyrant.
@@ -88,6 +90,10 @@ class Tyrant(object):
 
     """
 
+    # the state lives in the remote database; keep the client object lean
+    __slots__ = ('proto', 'literal', '_db_type', '_separator', '_to_python',
+                 '__weakref__')
+
     def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, separator=None,
                  literal=False):
         """
@@ -96,9 +102,12 @@ class Tyrant(object):
         # keep the protocol public just in case anyone needs a specific option
         self.proto = protocol.TyrantProtocol(host, port)
 
-        self.separator = separator
+        # the type of a database cannot change, so it is only requested once
+        self._db_type = None
+
         if not separator and self.table_enabled:
-            self.separator = protocol.TABLE_COLUMN_SEP
+            separator = protocol.TABLE_COLUMN_SEP
+        self.separator = separator
 
         self.literal = literal
 
@@ -122,7 +131,7 @@ class Tyrant(object):
                             % (type(key).__name__, key))
         try:
             elem = self.proto.get(key, self.literal)
-            return utils.to_python(elem, self.db_type, self.separator)
+            return self._to_python(elem)
         except exceptions.TyrantError:
             raise KeyError(key)
 
@@ -149,33 +158,100 @@ class Tyrant(object):
         Sets given value for given primary key in the database.
         Additional types conversion is only done if the value is a dictionary.
         """
-        if isinstance(value, dict):
-            # check if there are no keys that would become empty strings
-            if not all(unicode(k) for k in value):
-                raise KeyError('Empty keys are not allowed (%s).' % repr(value))
-
-            # EXPLAIN why the 'from_python' conversion is necessary, as there
-            # is no straight forward way of restoring the python objects. What
-            # about limiting the allowed keys and values to string only, an
-            # raise exception on any other object type?
-            flat = list(itertools.chain(*((k, utils.from_python(v)) for
-                                           k,v in value.iteritems())))
-            args = [key] + flat
-            self.proto.misc('put', args)  # EXPLAIN why is this hack necessary?
-        else:
-            if isinstance(value, (list, tuple)):
-                assert self.separator, "Separator is not set"
-                prepared_value = self.separator.join(value)
+        setter = self._SETTERS.get(type(value))
+        if setter is None:
+            # not one of the common types, maybe a subclass of one
+            if isinstance(value, dict):
+                setter = Tyrant._set_dict
+            elif isinstance(value, (list, tuple)):
+                setter = Tyrant._set_sequence
             else:
-                prepared_value = value
-            self.proto.put(key, prepared_value)
+                setter = Tyrant._set_scalar
+        setter(self, key, value)
+
+    def _set_dict(self, key, value):
+        # check if there are no keys that would become empty strings
+        if not all(unicode(k) for k in value):
+            raise KeyError('Empty keys are not allowed (%s).' % repr(value))
+
+        # EXPLAIN why the 'from_python' conversion is necessary, as there
+        # is no straight forward way of restoring the python objects. What
+        # about limiting the allowed keys and values to string only, an
+        # raise exception on any other object type?
+        args = [None] * (1 + 2 * len(value))
+        args[0] = key
+        i = 1
+        for k, v in value.iteritems():
+            args[i] = k
+            args[i+1] = utils.from_python(v)
+            i += 2
+        self.proto.misc('put', args)  # EXPLAIN why is this hack necessary?
+
+    def _set_sequence(self, key, value):
+        assert self.separator, "Separator is not set"
+        self.proto.put(key, self.separator.join(value))
+
+    def _set_scalar(self, key, value):
+        self.proto.put(key, value)
+
+    def _join_dict(self, value):
+        # make flat string of interleaved key/value pairs
+        # EXPLAIN why is utils.from_python() not used here?
+        assert self.separator, 'Separator is not set'
+        strings = (str(x) for pair in value.iteritems() for x in pair)
+        return self.separator.join(strings)
+
+    def _join_iterable(self, value):
+        assert self.separator, 'Separator is not set'
+        strings = (str(x) for x in value)
+        return self.separator.join(strings)
+
+    # Value handlers looked up by exact type, which is cheaper than a chain of
+    # isinstance() checks on bulk operations. Other types (including
+    # subclasses) are resolved with isinstance().
+    _SETTERS = {
+        dict:    _set_dict,
+        list:    _set_sequence,
+        tuple:   _set_sequence,
+        str:     _set_scalar,
+        unicode: _set_scalar,
+        int:     _set_scalar,
+        long:    _set_scalar,
+        float:   _set_scalar,
+        bool:    _set_scalar,
+        type(None): _set_scalar,
+    }
+    _JOINERS = {
+        dict:    _join_dict,
+        list:    _join_iterable,
+        tuple:   _join_iterable,
+        str:     None,
+        unicode: None,
+        int:     None,
+        long:    None,
+        float:   None,
+        bool:    None,
+        type(None): None,
+    }
+
+    def _get_separator(self):
+        return self._separator
+
+    def _set_separator(self, separator):
+        self._separator = separator
+        # bind the record decoder once instead of choosing it for each record
+        self._to_python = utils.make_decoder(self.db_type, separator)
+
+    separator = property(_get_separator, _set_separator)
 
     @property
     def db_type(self):
-        stats = self.get_stats()
-        assert 'type' in stats and stats['type'], ('statistics must provide a '
-                                                   'valid database type')
-        return stats['type']
+        if self._db_type is None:
+            stats = self.get_stats()
+            assert 'type' in stats and stats['type'], ('statistics must provide '
+                                                       'a valid database type')
+            self._db_type = stats['type']
+        return self._db_type
 
     @property
     def db_path(self):
@@ -245,14 +321,20 @@ class Tyrant(object):
 
     def iterkeys(self):
         """
-        Iterates keys using remote operations.
+        Iterates keys using remote operations. The keys are requested in
+        pipelined batches to avoid a network round-trip per key.
         """
+        CHUNK_SIZE = 256
         self.proto.iterinit()
-        try:
-            while True:
-                yield self.proto.iternext()
-        except exceptions.TyrantError:
-            pass
+        pipe = self.proto.pipeline()
+        while True:
+            for i in xrange(CHUNK_SIZE):
+                pipe.iternext()
+            # the server reports the end of iteration as an error
+            for key in pipe.execute(raise_errors=False):
+                if isinstance(key, exceptions.TyrantError):
+                    return
+                yield key
 
     def keys(self):
         """
@@ -300,9 +382,11 @@ class Tyrant(object):
         {u'one': u'one'}
 
         """
-        if not key in self:
+        try:
+            return self[key]
+        except KeyError:
             self[key] = value
-        return self[key]
+            return self[key]
 
     def update(self, mapping=None, **kwargs):
         """
@@ -357,11 +441,13 @@ class Tyrant(object):
         Removes given records from the database.
         """
         # TODO: write better documentation: why would user need the no_update_log param?
-        opts = (no_update_log and protocol.TyrantProtocol.RDBMONOULOG or 0)
-        if not isinstance(keys, (list, tuple)):
-            keys = list(keys)
+        pipe = self.proto.pipeline()
+        self._queue_multi_del(pipe, keys, no_update_log)
+        pipe.execute()
 
-        self.proto.misc('outlist', keys, opts)
+    def _queue_multi_del(self, pipe, keys, no_update_log=False):
+        opts = (no_update_log and protocol.TyrantProtocol.RDBMONOULOG or 0)
+        pipe.misc('outlist', keys, opts)
 
     def multi_get(self, keys):
         """
@@ -373,20 +459,25 @@ class Tyrant(object):
             >>> g
             [('foo', {'one': 'one'}), ('bar', {'two': 'two'})]
 
-        :param keys: the list of keys.
+        :param keys: the list of keys; any iterable will do, e.g. a generator.
 
         """
         # TODO: write better documentation: why would user need the no_update_log param?
+        pipe = self.proto.pipeline()
+        self._queue_multi_get(pipe, keys)
+        data, = pipe.execute()
+        return self._getlist_to_pairs(data)
+
+    def _queue_multi_get(self, pipe, keys):
         assert hasattr(keys, '__iter__'), 'expected iterable, got %s' % keys
-        prep_val = lambda v: utils.to_python(v, self.db_type, self.separator)
+        pipe.misc('getlist', keys, 0)
 
-        keys = list(keys)
-        data = self.proto.misc('getlist', keys, 0)
+    def _getlist_to_pairs(self, data):
         data_keys = data[::2]
-        data_vals = (prep_val(x) for x in data[1::2])
+        data_vals = map(self._to_python, data[1::2])
         return zip(data_keys, data_vals)
 
-    def multi_set(self, items, no_update_log=False):
+    def multi_set(self, items, no_update_log=False, chunk_size=1000):
         """
         Stores the given records in the database. The records may be given
         as an iterable sequence. Usage::
@@ -398,8 +489,19 @@ class Tyrant(object):
            >>> t.multi_set({'foo': {'one': 'one'}, 'bar':{'two': 'two'}})
 
         :param items: the sequence of records to be stored.
+        :param chunk_size: maximum number of records per request. Each request
+            is sent as soon as it is complete, so the records given as an
+            iterator are never all kept in memory. If set to zero, all records
+            are sent in a single request.
 
         """
+        pipe = self.proto.pipeline()
+        self._queue_multi_set(pipe, items, no_update_log, chunk_size,
+                              flush=True)
+        pipe.execute()
+
+    def _queue_multi_set(self, pipe, items, no_update_log=False,
+                         chunk_size=1000, flush=False):
         # TODO: add here and in other places (in this module and protocol)
         # notes on the no-update-log param:
         #
@@ -424,20 +526,46 @@ class Tyrant(object):
             iterator = items.iteritems()
         else:
             iterator = iter(items)
+        joiners = self._JOINERS
         for key, value in iterator:
-            if isinstance(value, dict):
-                # make flat list of interleaved key/value pairs
-                new_value = []
-                for pair in value.items():
-                    new_value.extend(pair)  # EXPLAIN why is utils.from_python() not used here?
-                value = new_value
-            if hasattr(value, '__iter__'):
-                assert self.separator, 'Separator is not set'
-                strings = (str(x) for x in value)
-                value = self.separator.join(strings)
+            join = joiners.get(type(value), _MISSING)
+            if join is _MISSING:
+                # not one of the common types, maybe a subclass of one
+                if isinstance(value, dict):
+                    join = Tyrant._join_dict
+                elif hasattr(value, '__iter__'):
+                    join = Tyrant._join_iterable
+                else:
+                    join = None
+            if join is not None:
+                value = join(self, value)
             ready_pairs.extend((key, value))
+            if 0 < chunk_size <= len(ready_pairs) / 2:
+                pipe.misc('putlist', ready_pairs, opts)
+                ready_pairs = []
+                if flush:
+                    # send the chunk before the next one is built
+                    pipe.execute()
+
+        if ready_pairs:
+            pipe.misc('putlist', ready_pairs, opts)
+
+    def pipeline(self):
+        """
+        Returns a :class:`~pyrant.Pipeline` for the database. Bulk operations
+        queued in the pipeline are sent to the server in one go, so a batch of
+        them only costs a single network round-trip. The pipeline is executed
+        on leaving the `with` block::
+
+            >>> with t.pipeline() as pipe:
+            ...     pipe.multi_set({'foo': {'one': 'one'}})
+            ...     pipe.multi_get(['foo'])
+            ...     pipe.multi_del(['foo'])
+            >>> pipe.results
+            [None, [(u'foo', {u'one': u'one'})], None]
 
-        self.proto.misc('putlist', ready_pairs, opts)
+        """
+        return Pipeline(self)
 
     def prefix_keys(self, prefix, maxkeys=None):
         """
@@ -446,7 +574,7 @@ class Tyrant(object):
         """
         # TODO: write better documentation: describe purpose, provide example code
         if maxkeys is None:
-            maxkeys = len(self)
+            maxkeys = -1    # no limit; saves a request for the number of keys
 
         return self.proto.fwmkeys(prefix, maxkeys)
 
@@ -478,3 +606,72 @@ class Tyrant(object):
             raise TypeError('Query only works with table databases but %s is a '
                             '%s database.' % (self.db_path, self.db_type))
         return query.Query(self.proto, self.db_type, self.literal)
+
+
+class Pipeline(object):
+    """
+    A queue of bulk operations for :class:`Tyrant`. Mimics the bulk methods of
+    :class:`Tyrant` but only sends the queued requests when
+    :meth:`~Pipeline.execute` is called or, if used as a context manager, on
+    leaving the `with` block. Results of the operations are available as
+    :attr:`Pipeline.results` in the order the operations were queued.
+    """
+
+    def __init__(self, tyrant):
+        self.tyrant = tyrant
+        self.results = None
+        self._pipe = tyrant.proto.pipeline()
+        self._handlers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def _queued(self, start, handler=None):
+        # remember which responses belong to the operation and how to
+        # pythonify them
+        self._handlers.append((start, len(self._pipe), handler))
+
+    def execute(self):
+        """
+        Sends all queued operations to the database and returns the list of
+        their results. Operations that do not return anything yield `None`.
+        """
+        handlers, self._handlers = self._handlers, []
+        responses = self._pipe.execute()
+        self.results = []
+        for start, stop, handler in handlers:
+            if handler:
+                self.results.append(handler(*responses[start:stop]))
+            else:
+                self.results.append(None)
+        return self.results
+
+    def multi_del(self, keys, no_update_log=False):
+        """
+        Queues removal of given records. See :meth:`Tyrant.multi_del`.
+        """
+        start = len(self._pipe)
+        self.tyrant._queue_multi_del(self._pipe, keys, no_update_log)
+        self._queued(start)
+
+    def multi_get(self, keys):
+        """
+        Queues retrieval of given records. See :meth:`Tyrant.multi_get`.
+        """
+        start = len(self._pipe)
+        self.tyrant._queue_multi_get(self._pipe, keys)
+        self._queued(start, self.tyrant._getlist_to_pairs)
+
+    def multi_set(self, items, no_update_log=False, chunk_size=1000):
+        """
+        Queues storage of given records. See :meth:`Tyrant.multi_set`. Unlike
+        there, all requests are kept until the pipeline is executed.
+        """
+        start = len(self._pipe)
+        self.tyrant._queue_multi_set(self._pipe, items, no_update_log,
+                                     chunk_size)
+        self._queued(start)
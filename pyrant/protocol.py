@@ -29,39 +29,70 @@ DB_HASH   = 'hash'
 
 TABLE_COLUMN_SEP = '\x00'
 
+# Pipelined requests are sent in batches of at most this many bytes and the
+# replies to a batch are read before the next one is sent. The server does
+# not read further requests while its replies are not read, so sending too
+# much at once would leave both sides waiting for each other.
+PIPELINE_BATCH_SIZE = 32 * 1024
+
+# Binary formats used on each request are compiled once
+_INT = struct.Struct('>I')
+_INT_PAIR = struct.Struct('>II')
+_LONG = struct.Struct('>Q')
+_DOUBLE = struct.Struct('>QQ')
+
 def _ulen(expr):
     "Returns length of the string in bytes."
     return len(expr.encode(ENCODING)) if isinstance(expr, unicode) else len(expr)
 
 def _pack(code, *args):
-    # Craft string that we'll use to send data based on args type and content
-    buf = ''
+    # Craft string that we'll use to send data based on args type and content.
+    # The pieces are joined once at the end: concatenating them one by one
+    # would copy the whole buffer for each piece of a large request.
+    parts = []
     fmt = '>BB'
     largs = []
     for arg in args:
         if isinstance(arg, int):
-            fmt += 'I'
+            # negative numbers are meaningful for some commands, e.g. "no
+            # limit" for fwmkeys
+            fmt += 'I' if 0 <= arg else 'i'
             largs.append(arg)
 
         elif isinstance(arg, str):
-            buf += arg
+            parts.append(arg)
 
         elif isinstance(arg, unicode):
-            buf += arg.encode(ENCODING)
+            parts.append(arg.encode(ENCODING))
 
         elif isinstance(arg, long):
             fmt += 'Q'
             largs.append(arg)
 
         elif isinstance(arg, (list, tuple)):
-            for v in arg:
-                if isinstance(v, unicode):
-                    v = v.encode(ENCODING)
-                else:
-                    v = str(v)
-                buf += "%s%s" % (struct.pack(">I", len(v)), v)
+            parts.append(_pack_list(arg)[1])
+
+    return struct.pack(fmt, MAGIC_NUMBER, code, *largs) + ''.join(parts)
+
+def _pack_list(values):
+    # Packs each value prefixed by its length. Returns the number of values and
+    # the packed string. Values can be given by any iterable (e.g. generator);
+    # it is consumed while packing, so its length needs not be known upfront.
+    parts = []
+    pack_len = _INT.pack
+    for v in values:
+        if isinstance(v, unicode):
+            v = v.encode(ENCODING)
+        else:
+            v = str(v)
+        parts.append(pack_len(len(v)))
+        parts.append(v)
+    return len(parts) / 2, ''.join(parts)
 
-    return "%s%s" % (struct.pack(fmt, MAGIC_NUMBER, code, *largs), buf)
+def _pack_misc(func, args, opts):
+    # the number of arguments precedes them, so pack them first
+    numargs, packed_args = _pack_list(args)
+    return _pack(TyrantProtocol.MISC, len(func), opts, numargs, func) + packed_args
 
 
 class _TyrantSocket(object):
@@ -85,10 +116,24 @@ class _TyrantSocket(object):
         """
         sync = kwargs.pop('sync', True)
         # Send message to socket, then check for errors as needed.
-        self._sock.sendall(_pack(*args))
+        self.send_raw(_pack(*args))
         if not sync:
             return
 
+        self.check_status()
+
+    def send_raw(self, data):
+        """
+        Sends already packed data to the socket.
+        """
+        self._sock.sendall(data)
+
+    def check_status(self):
+        """
+        Retrieves the status byte of a response. Raises an exception which is
+        a subclass of :class:`~pyrant.exceptions.TyrantError` if the server
+        reports a failure.
+        """
         fail_code = ord(self.get_byte())
         if fail_code:
             raise exceptions.get_for_code(fail_code)
@@ -116,13 +161,13 @@ class _TyrantSocket(object):
         """
         Retrieves an integer (4 bytes) from the socket and returns it.
         """
-        return struct.unpack('>I', self.recv(4))[0]
+        return _INT.unpack(self.recv(4))[0]
 
     def get_long(self):
         """
         Retrieves a long integer (8 bytes) from the socket and returns it.
         """
-        return struct.unpack('>Q', self.recv(8))[0]
+        return _LONG.unpack(self.recv(8))[0]
 
     def get_str(self):
         """
@@ -142,7 +187,7 @@ class _TyrantSocket(object):
         """
         Retrieves two long integers (16 bytes) from the socket and returns them.
         """
-        intpart, fracpart = struct.unpack('>QQ', self.recv(16))
+        intpart, fracpart = _DOUBLE.unpack(self.recv(16))
         return intpart + (fracpart * 1e-12)
 
     def get_strpair(self):
@@ -150,8 +195,8 @@ class _TyrantSocket(object):
         Retrieves a pair of strings (n bytes, n bytes which are 2 integers just
         before the pair) and returns them as a tuple of strings.
         """
-        klen = self.get_int()
-        vlen = self.get_int()
+        # both lengths are read at once
+        klen, vlen = _INT_PAIR.unpack(self.recv(8))
         return self.recv(klen), self.recv(vlen)
 
 
@@ -366,7 +411,11 @@ class TyrantProtocol(object):
             [('foo', 'bar\x00baz'), ('fox', 'box\x00quux')]
 
         """
-        self._sock.send(self.MGET, len(keys), keys)
+        self._sock.send_raw(_pack(self.MGET, len(keys), keys))
+        return self._recv_mget()
+
+    def _recv_mget(self):
+        self._sock.check_status()
         numrecs = self._sock.get_int()
         return [self._sock.get_strpair() for i in xrange(numrecs)]
 
@@ -401,8 +450,8 @@ class TyrantProtocol(object):
             InvalidOperation
 
         """
-        self._sock.send(self.ITERNEXT)
-        return self._sock.get_unicode()
+        self._sock.send(self.ITERNEXT, sync=False)
+        return self._recv_unicode()
 
     def fwmkeys(self, prefix, maxkeys=-1):
         """
@@ -657,6 +706,7 @@ class TyrantProtocol(object):
         Executes custom function.
 
         :param func: the function name (see below)
+        :param args: the function arguments; any iterable, e.g. a generator
         :param opts: a bitflag (see below)
 
         Functions supported by all databases:
@@ -677,9 +727,119 @@ class TyrantProtocol(object):
 
         * :const:`TyrantProtocol.RDBMONOULOG` to prevent writing to the update log.
         """
+        self._sock.send_raw(_pack_misc(func, args, opts))
+        return self._recv_misc()
+
+    def _recv_unicode(self):
+        self._sock.check_status()
+        return self._sock.get_unicode()
+
+    def _recv_misc(self):
+        # the number of records follows the status byte even if the function
+        # has failed, so it must be consumed anyway
         try:
-            self._sock.send(self.MISC, len(func), opts, len(args), func, args)
+            self._sock.check_status()
         finally:
             numrecs = self._sock.get_int()
 
         return [self._sock.get_unicode() for i in xrange(numrecs)]
+
+    def pipeline(self):
+        """
+        Returns a :class:`~pyrant.protocol.TyrantPipeline` bound to this
+        connection.
+        """
+        return TyrantPipeline(self)
+
+
+class TyrantPipeline(object):
+    """
+    Collects requests and sends them to the server in one go, then reads the
+    responses in the same order. This way a batch of requests only costs a
+    single network round-trip instead of one round-trip per request. Large
+    batches are split: at most :const:`PIPELINE_BATCH_SIZE` bytes of requests
+    (or a single larger request) are sent before the responses to them are
+    read::
+
+        >>> pipe = p.pipeline()
+        >>> pipe.misc('outlist', ['a', 'b'])
+        >>> pipe.misc('getlist', ['a', 'b'])
+        >>> pipe.execute()
+        [[], []]
+
+    Nothing is sent to the server until :meth:`execute` is called.
+    """
+
+    def __init__(self, proto):
+        self._proto = proto
+        self._frames = []
+        self._readers = []
+
+    def __len__(self):
+        return len(self._readers)
+
+    def misc(self, func, args, opts=0):
+        """
+        Queues a custom function call. See
+        :meth:`~pyrant.protocol.TyrantProtocol.misc`.
+        """
+        self._frames.append(_pack_misc(func, args, opts))
+        self._readers.append(self._proto._recv_misc)
+
+    def mget(self, keys):
+        """
+        Queues a request for key,value pairs. See
+        :meth:`~pyrant.protocol.TyrantProtocol.mget`.
+        """
+        self._frames.append(_pack(TyrantProtocol.MGET, len(keys), keys))
+        self._readers.append(self._proto._recv_mget)
+
+    def iternext(self):
+        """
+        Queues a request for the next key. See
+        :meth:`~pyrant.protocol.TyrantProtocol.iternext`. The end of iteration
+        is reported as an error.
+        """
+        self._frames.append(_pack(TyrantProtocol.ITERNEXT))
+        self._readers.append(self._proto._recv_unicode)
+
+    def execute(self, raise_errors=True):
+        """
+        Sends all queued requests and returns the list of responses. The queue
+        is emptied.
+
+        :param raise_errors: if True (default), the first error reported by the
+            server is raised after all responses are read. If False, the
+            exception instances are returned in place of failed responses.
+        """
+        frames, readers = self._frames, self._readers
+        self._frames, self._readers = [], []
+        if not readers:
+            return []
+
+        results = []
+        error = None
+        start, count = 0, len(frames)
+        while start < count:
+            # send as many requests as fit in a batch, but at least one
+            size = len(frames[start])
+            stop = start + 1
+            while stop < count and size + len(frames[stop]) <= PIPELINE_BATCH_SIZE:
+                size += len(frames[stop])
+                stop += 1
+            self._proto._sock.send_raw(''.join(frames[start:stop]))
+
+            # all responses must be read even if some of them are errors,
+            # otherwise they would be mistaken for responses to later requests
+            for reader in readers[start:stop]:
+                try:
+                    results.append(reader())
+                except exceptions.TyrantError, e:
+                    if error is None:
+                        error = e
+                    results.append(e)
+            start = stop
+
+        if raise_errors and error is not None:
+            raise error
+        return results
@@ -4,14 +4,22 @@
 Query classes for Tokyo Tyrant API implementation.
 """
 
-import copy
+from itertools import islice
 import warnings
 
-from protocol import TyrantProtocol
+from protocol import TyrantProtocol, ENCODING, TABLE_COLUMN_SEP
 import utils
 
 
 CACHE_CHUNK_SIZE = 1000
+CACHE_MAX_CHUNKS = 100
+CACHE_PREFETCH = 1
+# maximum number of chunks fetched in a single round-trip
+CACHE_BATCH_CHUNKS = 4
+# number of items displayed by Query.__repr__
+REPR_OUTPUT_SIZE = 20
+# types of expressions treated as lists of values by lookups
+ITERABLE_TYPES = (list, tuple, set, frozenset)
 
 
 class Query(object):
@@ -45,9 +53,13 @@ class Query(object):
         self._ordering = Ordering()
         self._proto = proto
         self._db_type = db_type
+        # the database type is fixed, so the record conversion is chosen once
+        self._to_python = utils.make_decoder(db_type)
         self._columns = columns
         self._ms_type = ms_type
         self._ms_conditions = ms_conditions
+        # search-ready conditions and metasearch conditions; filled on search
+        self._prepared = None
 
         # cache
         self._cache = ResultCache(self)
@@ -60,8 +72,7 @@ class Query(object):
         return self.intersect(other)
 
     def __contains__(self, key):
-        keys = self._cache.get_keys(self._do_search)
-        return key in keys
+        return self._cache.has_key(key, self._do_search)
 
     def __getitem__(self, k):
         # Retrieve an item or slice from the set of results.
@@ -82,16 +93,17 @@ class Query(object):
 
     def _get_slice(self, s):
         # Check slice integrity    XXX check if this is still resonable
-        for x in s.start, s.stop:
-            if x is not None and x < 0:
-                raise ValueError('Negative indexing is not supported')
-        if s.start and s.start == s.stop:
-            raise ValueError('Zero-length slices are not supported')
+        if (s.start is not None and s.start < 0) or \
+           (s.stop is not None and s.stop < 0):
+            raise ValueError('Negative indexing is not supported')
+        start = s.start or 0
+        if s.stop is not None and s.stop <= start:
+            return []
 
         # retrieve and cache keys
         self._cache.get_keys(self._do_search)
 
-        items = self._cache.get_items(s.start or 0, s.stop)
+        items = self._cache.get_items(start, s.stop)
         return list(items)
 
     def _get_item(self, index):
@@ -106,15 +118,30 @@ class Query(object):
             raise IndexError
         return item
 
+    def __iter__(self):
+        cache = self._cache
+        if cache.has_keys() and None not in cache.chunks:
+            # everything is cached already (e.g. after "query[:]")
+            return cache.get_items(0)
+        # a single pass does not need the cache
+        return self.iter_all()
+
     def __len__(self):
-        return len(self[:])
+        if self._cache.has_keys():
+            return len(self._cache.keys)
+        # let the server count the items instead of fetching them
+        return self.count()
 
     def __or__(self, other):
         return self.union(other)
 
     def __repr__(self):
-        # Do the query using getitem
-        return str(self[:])
+        # only display the first items; they are not cached
+        size = REPR_OUTPUT_SIZE + 1
+        items = list(islice(self.iter_all(chunk_size=size, prefetch=0), size))
+        if REPR_OUTPUT_SIZE < len(items):
+            items[-1] = '...(remaining elements truncated)...'
+        return str(items)
 
     def __sub__(self, other):
         return self.minus(other)
@@ -138,36 +165,41 @@ class Query(object):
         other = other._clone()
         query._ms_conditions.append(other._conditions)
         query._ms_type = operator
+        query._prepared = None
         return query
 
     def _clone(self):
-        defaults = {
-            'literal': self.literal,
-            'conditions': [c._clone() for c in self._conditions],
-            'ms_type': self._ms_type,
-        }
-
+        # trusted copy: the conditions are already validated and the decoder
+        # is already chosen, so __init__ is bypassed
+        query = self.__class__.__new__(self.__class__)
+        query.literal = self.literal
+        query._conditions = [c._clone() for c in self._conditions]
+        query._ordering = self._ordering._clone()
+        query._proto = self._proto
+        query._db_type = self._db_type
+        query._to_python = self._to_python
+        query._columns = self._columns[:] if self._columns else None
+        query._ms_type = self._ms_type
+        query._ms_conditions = None
         if self._ms_conditions:
-            defaults.update(
-                ms_conditions = [[query._clone() for query in conds]
-                                    for conds in self._ms_conditions],
-            )
-
-        if self._columns:
-            defaults.update(columns=self._columns[:])
-
-        return Query(self._proto, self._db_type, **defaults)
+            query._ms_conditions = [[q._clone() for q in conds]
+                                    for conds in self._ms_conditions]
+        # the cloned conditions are the same, but the clone may be altered
+        query._prepared = None
+        query._cache = ResultCache(query)
+        return query
 
     def _do_search(self, conditions=None, limit=None, offset=None,
                    out=False, count=False, hint=False, columns=None):
         """
         Returns keys of items that correspond to the Query instance.
         """
+        prepared_conditions, prepared_ms_conditions = self._prepare_conditions()
         defaults = {
             'out': out,
             'count': count,
             'hint': hint,
-            'conditions': conditions or [c.prepare() for c in self._conditions],
+            'conditions': conditions or prepared_conditions,
             'limit': limit,
             'offset': offset,
         }
@@ -182,13 +214,24 @@ class Query(object):
             # update search conditions with metaseach conditions
             defaults.update(
                 ms_type = self._ms_type,
+                ms_conditions = prepared_ms_conditions,
+            )
+
+        return self._proto.search(**defaults)
+
+    def _prepare_conditions(self):
+        # conditions do not change once the query is built, so they are only
+        # prepared for the first search
+        if self._prepared is None:
+            ms_conditions = None
+            if self._ms_conditions:
                 ms_conditions = [
                     [condition.prepare() for condition in metasearch_conditions]
                     for metasearch_conditions in self._ms_conditions
                 ]
-            )
-
-        return self._proto.search(**defaults)
+            conditions = [c.prepare() for c in self._conditions]
+            self._prepared = conditions, ms_conditions
+        return self._prepared
 
     def _filter(self, negate, args, kwargs):
         query = self._clone()
@@ -208,9 +251,6 @@ class Query(object):
 
         return query
 
-    def _to_python(self, elem):
-        return utils.to_python(elem, self._db_type)
-
     #
     # PUBLIC API
     #
@@ -431,14 +471,36 @@ class Query(object):
         """
         self._cache = ResultCache(self, chunk_size=size)
 
+    def iter_all(self, chunk_size=None, prefetch=None):
+        """
+        Generates all items matched by the query. Unlike slicing, this does not
+        fill the cache: the items are fetched by chunks of `chunk_size` (the
+        cache chunk size by default) and only the current batch of chunks is
+        kept in memory. This is suitable for a single pass over large results.
+
+        :param prefetch: number of chunks fetched along with each chunk in the
+            same round-trip (the cache setting by default).
+        """
+        keys = self._cache.get_keys(self._do_search)
+        decode = self._to_python
+        items = self._cache.iter_raw_items(keys, chunk_size, prefetch)
+        for key, value in items:
+            yield key, decode(value)
+
     def stat(self):
         """
         Returns statistics on key usage.
         """
+        keys = self._cache.get_keys(self._do_search)
         collected = {}
-        for _, data in self[:]:
-            for k in data:
-                collected[k] = collected.get(k, 0) + 1
+        get = collected.get
+        # only column names are needed, so the records are not converted and
+        # are not cached
+        for _, value in self._cache.iter_raw_items(keys):
+            if not value:
+                continue
+            for k in value.split(TABLE_COLUMN_SEP)[::2]:
+                collected[k] = get(k, 0) + 1
         return collected
 
     def union(self, other):
@@ -452,7 +514,15 @@ class Query(object):
         """
         Returns a list of unique values for given key.
         """
-        return list(set(d[key] for d in self.columns(key)))
+        # only one column is needed, so the records are not fully converted
+        get_column = utils.get_column
+        seen = set()
+        add = seen.add
+        for record in self._do_search(columns=[key]):
+            value = get_column(record, key)
+            if value is not None:
+                add(value)
+        return list(seen)
 
 class Lookup(object):
     """
@@ -471,6 +541,7 @@ class Lookup(object):
         self.string = string
 
         self.operator = getattr(TyrantProtocol, constant)
+        self.negated_operator = self.operator | TyrantProtocol.RDBQCNEGATE
 
         # custom value; only used if "has_custom_value" is True
         self.value = value
@@ -483,32 +554,40 @@ class Lookup(object):
         # additional value processor; executed per item if value is iterable
         self.extra = extra
 
-    def accepts(self, value):
-        """
-        Returns True if given value is acceptable for this lookup definition.
-        """
-        if self.iterable:
-            if not hasattr(value, '__iter__'):
-                return False
-            if value:
-                value = value[0]
+        # the flags never change, so the acceptance test is assembled once
+        self.accepts = self._compile_accepts()
+
+    def _compile_accepts(self):
+        checks = []
         if self.boolean:
-            if not isinstance(value, bool):
-                return False
+            checks.append(lambda v: isinstance(v, bool))
         if self.numeric:
-            if not isinstance(value, (int, float)):
-                try:
-                    int(value)
-                except (ValueError, TypeError):
-                    return False
+            checks.append(_is_numeric)
         if self.string:
-            if not isinstance(value, basestring):
-                return False
-        return True
+            checks.append(lambda v: isinstance(v, basestring))
+        checks = tuple(checks)
+        iterable = self.iterable
+
+        def accepts(value):
+            """
+            Returns True if given value is acceptable for this lookup
+            definition.
+            """
+            if iterable:
+                if not isinstance(value, ITERABLE_TYPES):
+                    return False
+                if value:
+                    # sets cannot be indexed
+                    value = iter(value).next()
+            for check in checks:
+                if not check(value):
+                    return False
+            return True
+        return accepts
 
     def process_value(self, value):
         if self.extra:
-            if hasattr(value, '__iter__'):
+            if isinstance(value, ITERABLE_TYPES):
                 return [self.extra(v) for v in value]
             else:
                 return self.extra(value)
@@ -520,7 +599,7 @@ class Lookup(object):
         Checks if value does not only look acceptable, but is also valid. Returns
         the value.
         """
-        if hasattr(value, '__iter__'):
+        if isinstance(value, ITERABLE_TYPES):
             if self.min_args and len(value) < self.min_args:
                 raise ValueError('expected at least %d arguments' % self.min_args)
             if self.max_args and self.max_args < len(value):
@@ -532,6 +611,16 @@ class ExistanceLookup(Lookup):
     has_custom_value = True
 
 
+def _is_numeric(value):
+    if isinstance(value, (int, float)):
+        return True
+    try:
+        int(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
 class Condition(object):
     """
     Representation of a query condition. Maps lookups to protocol constants.
@@ -539,32 +628,33 @@ class Condition(object):
 
     # each lookup has 1..n definitions that can be used to a) check if the
     # lookup suits the expression, and b) to construct the condition in terms
-    # of low-level API.
+    # of low-level API. Definitions are tuples so that aliased entries (see
+    # below) cannot be changed through each other.
     LOOKUP_DEFINITIONS = {
-        'between':      [Lookup('RDBQCNUMBT', iterable=True, numeric=True,
-                                min_args=2, max_args=2)],
-        'contains':     [Lookup('RDBQCSTRINC', string=True),
-                         Lookup('RDBQCSTRAND', iterable=True, string=True)],
-        'contains_any': [Lookup('RDBQCSTROR', iterable=True, string=True)],
-        'endswith':     [Lookup('RDBQCSTREW', string=True)],
-        'exists':       [ExistanceLookup('RDBQCSTRRX', boolean=True, value='')],
-        'gt':           [Lookup('RDBQCNUMGT', numeric=True)],
-        'gte':          [Lookup('RDBQCNUMGE', numeric=True)],
-        'in':           [Lookup('RDBQCSTROREQ', iterable=True, string=True),
-                         Lookup('RDBQCNUMOREQ', iterable=True, numeric=True)],
-        'is':           [Lookup('RDBQCNUMEQ', numeric=True),
-                         Lookup('RDBQCSTREQ')],
-        'like':         [Lookup('RDBQCFTSPH', string=True,
+        'between':      (Lookup('RDBQCNUMBT', iterable=True, numeric=True,
+                                min_args=2, max_args=2),),
+        'contains':     (Lookup('RDBQCSTRINC', string=True),
+                         Lookup('RDBQCSTRAND', iterable=True, string=True),),
+        'contains_any': (Lookup('RDBQCSTROR', iterable=True, string=True),),
+        'endswith':     (Lookup('RDBQCSTREW', string=True),),
+        'exists':       (ExistanceLookup('RDBQCSTRRX', boolean=True, value=''),),
+        'gt':           (Lookup('RDBQCNUMGT', numeric=True),),
+        'gte':          (Lookup('RDBQCNUMGE', numeric=True),),
+        'in':           (Lookup('RDBQCSTROREQ', iterable=True, string=True),
+                         Lookup('RDBQCNUMOREQ', iterable=True, numeric=True),),
+        'is':           (Lookup('RDBQCNUMEQ', numeric=True),
+                         Lookup('RDBQCSTREQ'),),
+        'like':         (Lookup('RDBQCFTSPH', string=True,
                                 extra=lambda v:v.lower()),
                          Lookup('RDBQCFTSAND', iterable=True, string=True,
-                                extra=lambda v:v.lower())],
-        'like_any':     [Lookup('RDBQCFTSOR', iterable=True, string=True,
-                                extra=lambda v:v.lower())],
-        'lt':           [Lookup('RDBQCNUMLT', numeric=True)],
-        'lte':          [Lookup('RDBQCNUMLE', numeric=True)],
-        'matches':      [Lookup('RDBQCSTRRX', string=True)],
-        'search':       [Lookup('RDBQCFTSEX', string=True)],
-        'startswith':   [Lookup('RDBQCSTRBW', string=True)],
+                                extra=lambda v:v.lower()),),
+        'like_any':     (Lookup('RDBQCFTSOR', iterable=True, string=True,
+                                extra=lambda v:v.lower()),),
+        'lt':           (Lookup('RDBQCNUMLT', numeric=True),),
+        'lte':          (Lookup('RDBQCNUMLE', numeric=True),),
+        'matches':      (Lookup('RDBQCSTRRX', string=True),),
+        'search':       (Lookup('RDBQCFTSEX', string=True),),
+        'startswith':   (Lookup('RDBQCSTRBW', string=True),),
     }
     # default lookup (if none provided by the user)
     LOOKUP_DEFINITIONS[None] = LOOKUP_DEFINITIONS['is']
@@ -576,12 +666,43 @@ class Condition(object):
         self.expr = expr
         self.negate = negate
 
+    def _get_expr(self):
+        return self._expr
+
+    def _set_expr(self, expr):
+        if hasattr(expr, '__iter__') and not isinstance(expr, ITERABLE_TYPES):
+            # other iterables (e.g. xrange or generators) are stored as lists
+            # so that lookups only deal with known types and can be prepared
+            # more than once
+            expr = list(expr)
+        self._expr = expr
+        self._prepared = None
+
+    expr = property(_get_expr, _set_expr)
+
+    def _get_negate(self):
+        return self._negate
+
+    def _set_negate(self, negate):
+        self._negate = negate
+        self._prepared = None
+
+    negate = property(_get_negate, _set_negate)
+
     def __repr__(self):  # pragma: nocover
         return u'<%s %s%s %s>' % (self.name, ('not ' if self.negate else ''),
                                      self.lookup, repr(self.expr))
 
     def _clone(self):
-        return copy.copy(self)
+        # trusted copy: no need to parse the lookup again
+        clone = self.__class__.__new__(self.__class__)
+        clone.name = self.name
+        clone.lookup = self.lookup
+        clone._expr = self._expr
+        clone._negate = self._negate
+        # same expression and negation, so the prepared triple still holds
+        clone._prepared = self._prepared
+        return clone
 
     def _parse_lookup(self, lookup):
         """
@@ -597,28 +718,33 @@ class Condition(object):
     def prepare(self):
         """
         Returns search-ready triple: column name, operator code, expression.
+        The triple is computed once and reused until the expression or the
+        negation changes.
         """
+        if self._prepared is None:
+            self._prepared = self._prepare()
+        return self._prepared
 
+    def _prepare(self):
         if not self.lookup in self.LOOKUP_DEFINITIONS:
             available_lookups = ', '.join(str(x) for x in self.LOOKUP_DEFINITIONS)
             raise NameError('Unknown lookup "%s". Available are: %s' %
                             (self.lookup, available_lookups))
 
         definitions = self.LOOKUP_DEFINITIONS[self.lookup]
+        expr = self.expr
 
         for definition in definitions:
-            if definition.accepts(self.expr):
+            if definition.accepts(expr):
                 try:
-                    value = definition.validate(self.expr)
+                    value = definition.validate(expr)
                 except ValueError, e:
                     raise ValueError(u'Bad lookup %s__%s=%s: %s' % (
                                      self.name,
                                      self.lookup,
-                                     (self.expr if hasattr(self.expr,'__iter__') else u'"%s"'%self.expr),
+                                     (expr if isinstance(expr, ITERABLE_TYPES) else u'"%s"'%expr),
                                      unicode(e)))
 
-                op = definition.operator
-
                 # deal with negation: it can be external ("exclude(...)") or
                 # internal ("foo__exists=False")
                 negate = self.negate
@@ -633,19 +759,21 @@ class Condition(object):
                     value = definition.process_value(value)
 
                 if negate:
-                    op = op | TyrantProtocol.RDBQCNEGATE
+                    op = definition.negated_operator
+                else:
+                    op = definition.operator
 
                 # boolean values are stored as integers
                 value = utils.from_python(value)
 
                 # flatten list (TC can search tokens)
-                if hasattr(value, '__iter__'):
-                    value = ', '.join(unicode(x) for x in value)
+                if isinstance(value, ITERABLE_TYPES):
+                    value = u', '.join(map(unicode, value))
 
                 return self.name, op, value
 
         raise ValueError(u'could not find a definition for lookup "%s" suitable'
-                         u' for value "%s"' % (self.lookup, self.expr))
+                         u' for value "%s"' % (self.lookup, expr))
 
 
 class Ordering(object):
@@ -674,16 +802,29 @@ class Ordering(object):
         self.direction = direction or self.ASC
         self.method = self.NUMERIC if numeric else self.ALPHABETIC
 
+    def _key(self):
+        return self.name, self.direction, self.method
+
+    def _clone(self):
+        clone = self.__class__.__new__(self.__class__)
+        clone.name = self.name
+        clone.direction = self.direction
+        clone.method = self.method
+        return clone
+
     def __eq__(self, other):
         """
         Returns True if key attributes of compared instances are the same.
         """
         if not isinstance(other, type(self)):
-            raise TypeError('Expected %s instance, got %s' % type(self), other)
-        for attr in 'name', 'direction', 'method':
-            if getattr(self, attr) != getattr(other, attr):
-                return False
-        return True
+            raise TypeError('Expected %s instance, got %s' % (type(self), other))
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
 
     def __nonzero__(self):
         return bool(self.name)
@@ -705,12 +846,26 @@ class ResultCache(object):
     Represents query results. Implements result caching by chunks. Supports
     slicing and access by item index. Intended to be used internally by
     :class:`~pyrant.query.Query` objects.
+
+    At most `max_chunks` chunks are kept; the least recently used ones are
+    dropped and fetched again if needed. The chunks needed for a slice are
+    fetched in batches of up to `CACHE_BATCH_CHUNKS` chunks per round-trip. When items are streamed past the cache
+    (see :meth:`iter_raw_items`), `prefetch` following chunks are fetched
+    along with each chunk.
     """
-    def __init__(self, query, chunk_size=None):
+    def __init__(self, query, chunk_size=None, max_chunks=None, prefetch=None):
         self.query = query
-        self.chunks = {}
+        # one slot per chunk, allocated when the keys are known; slots of
+        # chunks that are not cached are None
+        self.chunks = []
         self.keys = None
+        # set of the same keys for membership tests; built on demand
+        self._keyset = None
         self.chunk_size = chunk_size or CACHE_CHUNK_SIZE
+        self.max_chunks = max_chunks or CACHE_MAX_CHUNKS
+        self.prefetch = CACHE_PREFETCH if prefetch is None else prefetch
+        # numbers of cached chunks, least recently used first
+        self._chunk_order = []
 
     def get_keys(self, getter):
         """
@@ -723,9 +878,31 @@ class ResultCache(object):
             keys = getter()
             assert hasattr(keys, '__iter__'), (
                 'getter must return an iterable, got %s' % keys)
-            self.keys = list(keys)
+            if not isinstance(keys, list):
+                keys = list(keys)
+            self.keys = keys
+            self._keyset = None
+            size = self.chunk_size
+            self.chunks = [None] * ((len(self.keys) + size - 1) / size)
+            self._chunk_order = []
         return self.keys
 
+    def has_keys(self):
+        """
+        Returns True if the keys are already cached, i.e. :meth:`get_keys`
+        would not call the getter.
+        """
+        return self.keys is not None
+
+    def has_key(self, key, getter):
+        """
+        Returns True if given key is among the cached keys. The keys are
+        retrieved with `getter` if needed (see :meth:`get_keys`).
+        """
+        if self._keyset is None:
+            self._keyset = set(self.get_keys(getter))
+        return key in self._keyset
+
     def get_item(self, index):
         """
         Returns an item corresponding to current query and given index. Fills
@@ -741,21 +918,29 @@ class ResultCache(object):
         Generates a sequence of items corresponding to current query and given
         slice boundaries. Fills related chunks of cache behind the scenes.
         """
+        size = self.chunk_size
+        chunk = start / size
+        offset = chunk * size
         if stop:
             assert start < stop
-        chunk = self.get_chunk_number(start)
-        while 1:
-            chunk_start, chunk_stop = self.get_chunk_boundaries(chunk)
-            if stop and stop <= chunk_start:
-                raise StopIteration
-            data = self.get_chunk_data(chunk)
+            last_chunk = (stop - 1) / size
+            stop -= offset
+        else:
+            # the keys are known, so an open slice ends with the last chunk;
+            # it is fetched in the same bounded batches as any other slice
+            last_chunk = len(self.chunks) - 1
+        return islice(self._iter_chunks(chunk, last_chunk), start - offset, stop)
+
+    def _iter_chunks(self, chunk, last_chunk):
+        # yields items of subsequent chunks starting with given one until the
+        # last chunk or the end of results is reached
+        while chunk <= last_chunk:
+            # all chunks of the slice are known, fetch them in batches
+            data = self.get_chunk_data(chunk, last_chunk - chunk)
             if data is None:
-                raise StopIteration
-            for i, item in enumerate(data):
-                if stop and stop <= chunk_start + i:
-                    raise StopIteration
-                if start <= chunk_start + i:
-                    yield item
+                return
+            for item in data:
+                yield item
             chunk += 1
 
     def get_chunk_number(self, index):
@@ -776,28 +961,90 @@ class ResultCache(object):
         stop = start + self.chunk_size - 1
         return start, stop
 
-    def get_chunk_data(self, number):
+    def get_chunk_data(self, number, prefetch=0):
         """
         Returns a list of items that belong to given chunk. Hits the database
         and fills chunk cache. If there are no items for the chunk, returns
         `None`.
+
+        :param prefetch: number of subsequent chunks to fetch along with given
+            one if the latter is not cached yet. All of them are retrieved in a
+            single network round-trip. At most `CACHE_BATCH_CHUNKS` chunks
+            are fetched at once.
         """
-        # TODO: do not create empty chunks; check if right boundary is within
-        # keys length
-        if not number in self.chunks:
-            # fill cache chunk
-            assert self.keys is not None, 'Cache keys must be filled by query'
+        assert self.keys is not None, 'Cache keys must be filled by query'
+        chunks = self.chunks
+        # make sure the chunk is not going to be empty
+        if len(chunks) <= number:
+            return None
+        data = chunks[number]
+        if data is not None:
+            # mark the chunk as the most recently used one
+            order = self._chunk_order
+            if order[-1] != number:
+                order.remove(number)
+                order.append(number)
+            return data
+
+        # prefetched chunks must not push the requested one out of the cache,
+        # and a batch must be small enough for the server to answer without
+        # waiting for the replies to be read
+        prefetch = min(prefetch, self.max_chunks - 1, CACHE_BATCH_CHUNKS - 1)
+        last = min(number + prefetch + 1, len(chunks))
+        numbers = [n for n in xrange(number, last) if chunks[n] is None]
+        self._fetch_chunks(numbers)
+        return chunks[number]
+
+    def _fetch_chunks(self, numbers):
+        # hit the database: retrieve values for keys of all given chunks in one
+        # go, then fill cache chunks
+        pipe = self.query._proto.pipeline()
+        chunks_keys = []
+        for number in numbers:
             start, stop = self.get_chunk_boundaries(number)
-            # make sure the chunk is not going to be empty
-            if len(self.keys) <= start:
-                return None
-            # get keys that correspond to the chunk
             keys = self.keys[start:stop+1]
-            if not keys:
-                return None
-            # hit the database: retrieve values for these keys
-            pairs = self.query._proto.mget(keys)
-            # extend previously created empty list
-            prep = lambda k,v: (k, self.query._to_python(v))
-            self.chunks[number] = [prep(k,v) for k,v in pairs]
-        return self.chunks[number]
+            chunks_keys.append(keys)
+            pipe.mget(keys)
+
+        decode = self.query._to_python
+        for number, keys, data in zip(numbers, chunks_keys, pipe.execute()):
+            pairs = self._mget_to_pairs(keys, data)
+            self.chunks[number] = [(k, decode(v)) for k,v in pairs]
+            self._chunk_order.append(number)
+            if self.max_chunks < len(self._chunk_order):
+                self.chunks[self._chunk_order.pop(0)] = None
+
+    def _mget_to_pairs(self, keys, pairs):
+        # keep the order in which the search returned the keys; records
+        # removed since the search are silently skipped. The pairs are left
+        # as bytes (values may be in any encoding), so they are matched
+        # against encoded keys
+        found = dict((pair[0], pair) for pair in pairs)
+        encoded = (k.encode(ENCODING) if isinstance(k, unicode) else k
+                   for k in keys)
+        return [found[k] for k in encoded if k in found]
+
+    def iter_raw_items(self, keys, chunk_size=None, prefetch=None):
+        """
+        Generates key/value pairs for given keys; values are left as returned
+        by the database. The data is fetched by chunks of `chunk_size` items
+        but is not cached, so memory usage does not grow with the number of
+        items. Each chunk is fetched along with `prefetch` following chunks
+        (but no more than `CACHE_BATCH_CHUNKS` chunks in total) in a single
+        round-trip.
+        """
+        size = chunk_size or self.chunk_size
+        if prefetch is None:
+            prefetch = self.prefetch
+        prefetch = min(prefetch, CACHE_BATCH_CHUNKS - 1)
+        batch = size * (prefetch + 1)
+        for start in xrange(0, len(keys), batch):
+            pipe = self.query._proto.pipeline()
+            chunks_keys = []
+            for i in xrange(start, min(start + batch, len(keys)), size):
+                chunk_keys = keys[i:i + size]
+                chunks_keys.append(chunk_keys)
+                pipe.mget(chunk_keys)
+            for chunk_keys, data in zip(chunks_keys, pipe.execute()):
+                for pair in self._mget_to_pairs(chunk_keys, data):
+                    yield pair
@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
+from itertools import chain, izip
 import warnings
 from pyrant.protocol import DB_TABLE, TABLE_COLUMN_SEP
 
 
 def pairwise(elems):
     """
-    Splits given iterable in pairs. Returns a generator. If number of elems is
+    Splits given iterable in pairs. Returns an iterator. If number of elems is
     odd, None is added to the end of list::
 
         >>> from pyrant.utils import pairwise
@@ -17,11 +18,10 @@ def pairwise(elems):
 
     """
     assert hasattr(elems, '__iter__')
-    elems = list(elems)
-    if len(elems) % 2:
-        elems.append(None)
-    for i in xrange(0, len(elems), 2):
-        yield elems[i], elems[i+1]
+    # pairing a single iterator with itself yields adjacent elements; the
+    # trailing None only completes the last pair if the number is odd
+    it = chain(elems, [None])
+    return izip(it, it)
 
 def from_python(value):
     """
@@ -100,19 +100,86 @@ def to_python(value, db_type, sep=None):
     .. _models: http://pypi.python.org/pypi/doqu
     """
     if db_type == DB_TABLE:
-        # Split element by \x00 which is the column separator
-        elems = value.split(TABLE_COLUMN_SEP)
-        if not elems or not elems[0]:
-            return {}
-        #elems_len = len(elems)
-        #if elems_len % 2:
-        #    warnings.warn(u'odd number of key/value pairs in table record: %s'
-        #                  % value, Warning)
-        #    return {}
-        return dict((k, _elem_to_python(v, sep)) for k,v in pairwise(elems))
+        if sep == TABLE_COLUMN_SEP:
+            # column values cannot contain the column separator
+            sep = None
+        return _table_to_python(value, sep)
     else:
         return _elem_to_python(value, sep)
 
+def make_decoder(db_type, sep=None):
+    """
+    Returns a function that converts a database record to its pythonic
+    representation exactly like :func:`to_python` does for given database type
+    and separator. Useful when many records of the same database are converted
+    because the choice of conversion is only made once::
+
+        >>> from pyrant.protocol import DB_HASH
+        >>> from pyrant.utils import make_decoder
+        >>> decode = make_decoder(DB_HASH, sep=', ')
+        >>> decode('foo, bar')
+        ['foo', 'bar']
+
+    """
+    if db_type == DB_TABLE:
+        if sep == TABLE_COLUMN_SEP:
+            # column values cannot contain the column separator, so there is
+            # nothing to split
+            sep = None
+        return lambda value: _table_to_python(value, sep)
+    if sep:
+        return lambda value: _elem_to_python(value, sep)
+    return lambda value: value
+
+def _table_to_python(value, sep):
+    # Split element by \x00 which is the column separator
+    elems = value.split(TABLE_COLUMN_SEP)
+    if not elems or not elems[0]:
+        return {}
+    #elems_len = len(elems)
+    #if elems_len % 2:
+    #    warnings.warn(u'odd number of key/value pairs in table record: %s'
+    #                  % value, Warning)
+    #    return {}
+    if len(elems) % 2:
+        elems.append(None)
+    # pairing a single iterator with itself yields adjacent elements
+    it = iter(elems)
+    if not sep:
+        # column values are left intact, no need to inspect them one by one
+        return dict(izip(it, it))
+    return dict((k, _elem_to_python(v, sep)) for k,v in izip(it, it))
+
+def get_column(value, name, default=None):
+    """
+    Returns the value of given column from a raw table database record. Only
+    the bytes up to the column are inspected and no other columns are
+    converted, so this is cheaper than :func:`to_python` when a single column
+    is needed::
+
+        >>> from pyrant.utils import get_column
+        >>> get_column('name\\x00John\\x00age\\x0030', 'age')
+        '30'
+        >>> get_column('name\\x00John\\x00age\\x0030', 'email') is None
+        True
+
+    If the column is missing, `default` is returned.
+    """
+    start = 0
+    while True:
+        # the record is a sequence of "name\x00value" pairs joined by \x00
+        name_end = value.find(TABLE_COLUMN_SEP, start)
+        if name_end == -1:
+            return default
+        value_end = value.find(TABLE_COLUMN_SEP, name_end + 1)
+        if value[start:name_end] == name:
+            if value_end == -1:
+                return value[name_end + 1:]
+            return value[name_end + 1:value_end]
+        if value_end == -1:
+            return default
+        start = value_end + 1
+
 def _elem_to_python(elem, sep):
     if not elem:
         return elem
@@ -122,4 +189,14 @@ def _elem_to_python(elem, sep):
         return elem
 
 def csv_to_dict(lines):
+    """
+    Converts tab-separated name/value lines (e.g. the output of
+    :meth:`~pyrant.protocol.TyrantProtocol.stat`) to a dictionary in a single
+    pass::
+
+        >>> from pyrant.utils import csv_to_dict
+        >>> csv_to_dict('type\\ttable\\nrnum\\t6\\n') == {'type': 'table', 'rnum': '6'}
+        True
+
+    """
     return dict(line.split('\t', 1) for line in lines.splitlines() if line)